@@ -12,6 +12,7 @@ import asyncio
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import json
+import logging
 
 from flask import (
     Flask, request, render_template,
@@ -64,6 +65,9 @@ BUCKET_NAME       = os.environ['BUCKET_NAME']
 APP_BASE_URL      = os.environ.get('APP_BASE_URL', 'http://localhost:5000/watch/')
 SECRET_KEY        = os.environ.get('FLASK_SECRET_KEY', 'supersecret')
 
+# S3 폴더명용 안전 문자 치환 패턴 (모듈 로드 시 1회 컴파일)
+UNSAFE_NAME_PATTERN = re.compile(r'[^\w]')
+
 # ==== 번역 관련 설정 - 수정됨 (보안 및 성능 최적화) ====
 # 전역 번역기 인스턴스 (재사용으로 성능 향상)
 translator = None
@@ -776,6 +780,9 @@ def api_get_videos():
         uploads_ref = db.collection('uploads')
         docs = uploads_ref.stream()
         
+        # 루프 안 debug 로그의 f-string 포맷팅은 DEBUG 레벨일 때만 수행
+        debug_enabled = app.logger.isEnabledFor(logging.DEBUG)
+        
         videos = []
         for doc in docs:
             data = doc.to_dict()
@@ -796,7 +803,8 @@ def api_get_videos():
                         # 동영상 키가 존재하고 URL이 유효한지 확인
                         if lang_data.get('video_key') and lang_data.get('presigned_url'):
                             video_languages[lang_code] = True
-                            app.logger.debug(f"언어별 동영상 확인: {doc.id} - {lang_code}")
+                            if debug_enabled:
+                                app.logger.debug(f"언어별 동영상 확인: {doc.id} - {lang_code}")
                         
             except Exception as e:
                 app.logger.warning(f"언어별 동영상 확인 실패 ({doc.id}): {e}")
@@ -871,7 +879,7 @@ def api_upload_language_video():
         # 파일 업로드 처리
         ext = Path(file.filename).suffix.lower() or '.mp4'
         date_str = datetime.now().strftime('%Y%m%d')
-        safe_name = re.sub(r'[^\w]', '_', root_data.get('group_name', 'video'))
+        safe_name = UNSAFE_NAME_PATTERN.sub('_', root_data.get('group_name', 'video'))
         
         # 언어별 동영상 키 생성
         folder = f"videos/{group_id}_{safe_name}_{date_str}"
@@ -1009,7 +1017,7 @@ def upload_video():
     # 2) 그룹 ID 생성 및 S3 키 구성
     group_id = uuid.uuid4().hex
     date_str = datetime.now().strftime('%Y%m%d')
-    safe_name = re.sub(r'[^\w]', '_', group_name)
+    safe_name = UNSAFE_NAME_PATTERN.sub('_', group_name)
     folder = f"videos/{group_id}_{safe_name}_{date_str}"
     
     ext = Path(file.filename).suffix.lower() or '.mp4'
@@ -1326,6 +1334,7 @@ def get_video_languages(group_id):
         # 언어별 영상 확인
         lang_videos_ref = db.collection('uploads').document(group_id).collection('language_videos')
         lang_video_docs = lang_videos_ref.stream()
+        debug_enabled = app.logger.isEnabledFor(logging.DEBUG)
         
         for lang_video_doc in lang_video_docs:
             lang_code = lang_video_doc.id
@@ -1338,12 +1347,14 @@ def get_video_languages(group_id):
                     if video_key:
                         s3.head_object(Bucket=BUCKET_NAME, Key=video_key)
                         available_languages[lang_code] = True
-                        app.logger.debug(f"✅ {lang_code} 언어 영상 확인: {group_id}")
+                        if debug_enabled:
+                            app.logger.debug(f"✅ {lang_code} 언어 영상 확인: {group_id}")
                     else:
                         available_languages[lang_code] = False
                 except Exception:
                     available_languages[lang_code] = False
-                    app.logger.debug(f"❌ {lang_code} 언어 영상 없음: {group_id}")
+                    if debug_enabled:
+                        app.logger.debug(f"❌ {lang_code} 언어 영상 없음: {group_id}")
         
         # 지원하지 않는 언어는 False로 설정
         for lang_code in SUPPORTED_LANGUAGES.keys():
@@ -1378,15 +1389,30 @@ def create_certificate():
         if not user_uid or not cert_id or not pdf_url:
             return jsonify({'error': 'user_uid, cert_id, lectureTitle, pdfUrl이 필요합니다.'}), 400
 
-        cert_ref = db.collection('users').document(user_uid) \
-                     .collection('completedCertificates').document(cert_id)
-        cert_ref.set({
+        user_ref = db.collection('users').document(user_uid)
+        cert_ref = user_ref.collection('completedCertificates').document(cert_id)
+        cert_data = {
             'lectureTitle': lecture_title,
             'issuedAt': firestore.SERVER_TIMESTAMP,
             'pdfUrl': pdf_url,
             'excelUpdated': False,
             'readyForExcel': True
-        }, merge=True)
+        }
+
+        # 발급 시점 사용자 정보를 수료증에 복사 (엑셀 워커가 수료증마다 users 문서를 다시 조회하지 않도록)
+        try:
+            user_doc = user_ref.get()
+            if user_doc.exists:
+                user_data = user_doc.to_dict() or {}
+                cert_data.update({
+                    'userName': user_data.get('name', ''),
+                    'userPhone': user_data.get('phone', ''),
+                    'userEmail': user_data.get('email', '')
+                })
+        except Exception as e:
+            app.logger.warning(f"사용자 정보 복사 실패 (워커가 직접 조회): {e}")
+
+        cert_ref.set(cert_data, merge=True)
 
         return jsonify({'message': '수료증이 생성되었습니다.'}), 200
         
@@ -1468,7 +1494,6 @@ def initialize_railway_environment():
         
         # 환경별 로그 레벨 설정
         if os.environ.get('RAILWAY_ENVIRONMENT'):
-            import logging
             app.logger.setLevel(logging.INFO)
         
         app.logger.info("🚂 Railway 환경 초기화 완료 (플레이스토어 준수 + 다국어 지원)")
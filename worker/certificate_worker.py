@@ -2,18 +2,24 @@
 
 import os
 import io
+import gzip
 import time
+import random
 import logging
 import signal
 import sys
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, List, Tuple, Any
 import pandas as pd
+from openpyxl import load_workbook
+import xlsxwriter
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
+from google.api_core.exceptions import PreconditionFailed
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 from pathlib import Path
+from cachetools import TTLCache
 import json
 
 # ===================================================================
@@ -39,11 +45,35 @@ for var in required_env_vars:
         sys.exit(1)
 
 # 설정값
+FIRESTORE_BATCH_LIMIT = 500  # WriteBatch 당 최대 쓰기 수
 POLL_INTERVAL_SECONDS = max(30, int(os.getenv('POLL_INTERVAL_SECONDS', '45')))
-BATCH_SIZE = min(20, int(os.getenv('BATCH_SIZE', '15')))
+IDLE_POLL_MAX_SECONDS = 300  # 빈 폴링이 이어질 때 늘어나는 대기 시간의 상한
+ERROR_BACKOFF_MAX_SECONDS = 300  # 루프 오류가 이어질 때 재시도 대기 시간의 상한
+BATCH_SIZE = max(1, min(FIRESTORE_BATCH_LIMIT, int(os.getenv('BATCH_SIZE', '50'))))  # 플래그 갱신이 WriteBatch 한 번에 들어가도록 제한
 MASTER_FILENAME = "master_certificates.xlsx"
+MASTER_PARQUET_FILENAME = "master_certificates.parquet"  # 워커 기준 데이터 (xlsx는 여기서 주기적으로 내보냄)
+XLSX_EXPORT_EVERY_N_BATCHES = max(1, int(os.getenv('XLSX_EXPORT_EVERY_N_BATCHES', '5')))
 MAX_RETRY_COUNT = int(os.getenv('MAX_RETRY_COUNT', '5'))
 HEALTH_CHECK_INTERVAL = 300
+LISTENER_FALLBACK_POLL_SECONDS = max(POLL_INTERVAL_SECONDS, int(os.getenv('LISTENER_FALLBACK_POLL_SECONDS', '300')))
+EVENT_DEBOUNCE_SECONDS = 2  # 실시간 알림 후 도착분을 모으는 시간 (지연 vs 배치 크기)
+RESET_HIGH_RETRY_COUNT = os.getenv('RESET_HIGH_RETRY_COUNT', 'false').lower() == 'true'
+USER_CACHE_SIZE = 2048  # 사용자 정보 캐시 크기
+USER_CACHE_TTL_SECONDS = 3600  # 사용자 정보 변경(전화번호 등) 반영까지 최대 지연
+MISSING_USER_CACHE_TTL_SECONDS = 60  # 없는 사용자는 곧 생성될 수 있으므로 짧게만 캐시
+STATISTICS_INTERVAL_SECONDS = int(os.getenv('STATISTICS_INTERVAL_SECONDS', '600'))  # 진단 통계 로그 주기
+MASTER_COLUMNS = ['업데이트 날짜', '사용자 UID', '전화번호', '이메일', '사용자 이름', '강의 제목', '발급 일시', 'PDF URL']
+# 대기 수료증 조회 시 가져올 필드 (처리/플래그 갱신에 쓰는 필드 + 발급 시 복사된 사용자 정보)
+PENDING_CERT_FIELDS = ['lectureTitle', 'pdfUrl', 'issuedAt', 'retryCount', 'processingError', 'readyForExcel',
+                       'userName', 'userPhone', 'userEmail']
+GZIP_MIN_SAVING_RATIO = 0.1  # gzip 업로드는 10% 이상 줄어들 때만 사용
+LOCAL_BACKUP_PATH = Path('/tmp/master_certificates_backup.xlsx')
+BATCH_DEADLINE_SECONDS = int(os.getenv('BATCH_DEADLINE_SECONDS', '120'))  # 배치 처리 루프 시간 한도
+UPLOAD_TIMEOUT_SECONDS = 30  # 마스터 엑셀 업로드 요청 타임아웃 (실패 시 재시도 루프로 넘어감)
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+MASTER_CACHE_TTL_SECONDS = 600  # 이 시간 동안은 Storage 확인 없이 캐시 사용, 이후엔 generation 확인
+MASTER_FORCE_RELOAD_SECONDS = 3600  # 마지막 다운로드 후 이 시간이 지나면 generation이 같아도 다시 다운로드 (안전장치)
 
 # 🔧 Firebase Storage 버킷 이름 결정
 FIREBASE_STORAGE_BUCKET = os.getenv('FIREBASE_STORAGE_BUCKET')
@@ -102,6 +132,8 @@ bucket = storage.bucket()
 shutdown_flag = False
 current_operations = set()
 operations_lock = threading.Lock()
+# 마스터 다운로드용 스레드 풀 (배치마다 스레드를 새로 만들지 않고 재사용, 종료 시 정리)
+master_load_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='master-load')
 
 def signal_handler(signum, frame):
     global shutdown_flag
@@ -126,90 +158,128 @@ def log_operation_end(operation_id):
 # ===================================================================
 # 수료증 조회 함수들
 # ===================================================================
+class StatisticsState:
+    """진단 통계 실행 시각 (time.monotonic() 기준)"""
+    last_run_at = None
+
+def log_certificate_statistics():
+    """수료증 컬렉션 진단 통계 로그 (전체 개수/샘플 분석/필터별 개수)"""
+    # 1단계: 전체 수료증 문서 수 확인
+    try:
+        # 전체 개수는 count() 집계로, 샘플 분석용 문서는 20개만 조회
+        all_certs_query = db.collection_group('completedCertificates')
+        total_count = all_certs_query.count().get()[0][0].value
+        all_docs = list(all_certs_query.limit(20).stream())
+        logger.info(f"📊 전체 수료증 문서: {total_count}개 발견")
+        
+        # 샘플 분석
+        analysis = {
+            'has_pdf_url': 0,
+            'sent_to_admin_true': 0,
+            'excel_updated_false': 0,
+            'retry_over_limit': 0,
+            'processable': 0
+        }
+        
+        for doc in all_docs:
+            try:
+                data = doc.to_dict()
+                
+                if data.get('pdfUrl', '').strip():
+                    analysis['has_pdf_url'] += 1
+                
+                if data.get('sentToAdmin', False):
+                    analysis['sent_to_admin_true'] += 1
+                
+                if not data.get('excelUpdated', True):
+                    analysis['excel_updated_false'] += 1
+                
+                retry_count = data.get('retryCount', 0)
+                if retry_count >= MAX_RETRY_COUNT:
+                    analysis['retry_over_limit'] += 1
+                
+                # 처리 가능한 문서 조건
+                if (data.get('pdfUrl', '').strip() and 
+                    data.get('sentToAdmin', False) and 
+                    not data.get('excelUpdated', True) and 
+                    retry_count < MAX_RETRY_COUNT):
+                    analysis['processable'] += 1
+                    
+            except Exception:
+                continue
+        
+        logger.info(f"📈 샘플 분석 결과 (상위 20개):")
+        logger.info(f"  - PDF URL 있음: {analysis['has_pdf_url']}/20")
+        logger.info(f"  - sentToAdmin=true: {analysis['sent_to_admin_true']}/20")
+        logger.info(f"  - excelUpdated=false: {analysis['excel_updated_false']}/20")
+        logger.info(f"  - 재시도 한도 초과: {analysis['retry_over_limit']}/20")
+        logger.info(f"  - 처리 가능한 문서: {analysis['processable']}/20")
+        
+    except Exception as e:
+        logger.warning(f"⚠️ 전체 분석 실패: {e}")
+    
+    # 2단계: 실제 쿼리 실행
+    logger.info("🔍 실제 필터링 쿼리 실행")
+    
+    queries = [
+        ("excel미완료", db.collection_group('completedCertificates').where('excelUpdated', '==', False)),
+        ("전송완료", db.collection_group('completedCertificates').where('sentToAdmin', '==', True)),
+    ]
+    
+    for name, query in queries:
+        try:
+            # count() 집계: 문서 본문을 내려받지 않고 서버에서 개수만 계산 (limit 없이 정확한 개수)
+            doc_count = query.count().get()[0][0].value
+            logger.info(f"  📋 {name}: {doc_count}개 문서")
+        except Exception as e:
+            logger.warning(f"  ❌ {name} 실패: {e}")
+
+class PendingCursor:
+    """대기 수료증 조회 커서"""
+    # 스킵되어 남는 문서(PDF 없음/재시도 초과)를 매번 처음부터 다시 읽지 않도록 다음 조회 시작 위치를 보관
+    last_doc = None
+
+def stream_pending_docs(base_query, limit):
+    """커서 다음부터 최대 limit개 스트리밍 (끝까지 읽으면 커서 초기화 → 다음 조회는 처음부터)"""
+    query = base_query.limit(limit)
+    if PendingCursor.last_doc is not None:
+        query = query.start_after(PendingCursor.last_doc)
+    
+    streamed_count = 0
+    last_doc = None
+    for doc in query.stream():
+        streamed_count += 1
+        last_doc = doc
+        yield doc
+    
+    # 가득 찼으면 뒤에 더 있을 수 있으므로 마지막 문서 뒤부터 이어서 조회
+    PendingCursor.last_doc = last_doc if streamed_count >= limit else None
+
 def get_pending_certificates_debug(limit=50):
-    """디버깅이 포함된 수료증 조회"""
+    """디버깅이 포함된 수료증 조회 (조회 실패 시 None)"""
     operation_id = f"get_pending_debug_{int(time.time())}"
     log_operation_start(operation_id)
     
     try:
         logger.info("🔍 상세 디버깅 수료증 조회 시작")
         
-        # 1단계: 전체 수료증 문서 수 확인
-        try:
-            all_certs_query = db.collection_group('completedCertificates').limit(100)
-            all_docs = list(all_certs_query.stream())
-            logger.info(f"📊 전체 수료증 문서: {len(all_docs)}개 발견")
-            
-            # 샘플 분석
-            analysis = {
-                'has_pdf_url': 0,
-                'sent_to_admin_true': 0,
-                'excel_updated_false': 0,
-                'retry_over_limit': 0,
-                'processable': 0
-            }
-            
-            for doc in all_docs[:20]:
-                try:
-                    data = doc.to_dict()
-                    
-                    if data.get('pdfUrl', '').strip():
-                        analysis['has_pdf_url'] += 1
-                    
-                    if data.get('sentToAdmin', False):
-                        analysis['sent_to_admin_true'] += 1
-                    
-                    if not data.get('excelUpdated', True):
-                        analysis['excel_updated_false'] += 1
-                    
-                    retry_count = data.get('retryCount', 0)
-                    if retry_count >= MAX_RETRY_COUNT:
-                        analysis['retry_over_limit'] += 1
-                    
-                    # 처리 가능한 문서 조건
-                    if (data.get('pdfUrl', '').strip() and 
-                        data.get('sentToAdmin', False) and 
-                        not data.get('excelUpdated', True) and 
-                        retry_count < MAX_RETRY_COUNT):
-                        analysis['processable'] += 1
-                        
-                except Exception:
-                    continue
-            
-            logger.info(f"📈 샘플 분석 결과 (상위 20개):")
-            logger.info(f"  - PDF URL 있음: {analysis['has_pdf_url']}/20")
-            logger.info(f"  - sentToAdmin=true: {analysis['sent_to_admin_true']}/20")
-            logger.info(f"  - excelUpdated=false: {analysis['excel_updated_false']}/20")
-            logger.info(f"  - 재시도 한도 초과: {analysis['retry_over_limit']}/20")
-            logger.info(f"  - 처리 가능한 문서: {analysis['processable']}/20")
-            
-        except Exception as e:
-            logger.warning(f"⚠️ 전체 분석 실패: {e}")
-        
-        # 2단계: 실제 쿼리 실행
-        logger.info("🔍 실제 필터링 쿼리 실행")
-        
-        queries = [
-            ("기본", db.collection_group('completedCertificates').limit(limit)),
-            ("excel미완료", db.collection_group('completedCertificates').where('excelUpdated', '==', False).limit(limit)),
-            ("전송완료", db.collection_group('completedCertificates').where('sentToAdmin', '==', True).limit(limit)),
-        ]
-        
-        for name, query in queries:
-            try:
-                docs = list(query.stream())
-                logger.info(f"  📋 {name}: {len(docs)}개 문서")
-            except Exception as e:
-                logger.warning(f"  ❌ {name} 실패: {e}")
+        # 1~2단계 통계는 진단용 집계 쿼리라 매 배치가 아니라 일정 간격으로만 실행
+        if StatisticsState.last_run_at is None or \
+                time.monotonic() - StatisticsState.last_run_at >= STATISTICS_INTERVAL_SECONDS:
+            log_certificate_statistics()
+            StatisticsState.last_run_at = time.monotonic()
         
         # 3단계: 최종 처리 대상 수료증 조회
         logger.info("🔍 최종 처리 대상 조회")
         
         try:
+            # select(): 처리에 쓰는 필드만 전송받음 (문서 전체 대비 전송량 감소)
+            # order_by('__name__'): 기본 정렬과 같아 추가 인덱스 불필요, 커서 이어받기에 사용
             final_query = db.collection_group('completedCertificates') \
                            .where('sentToAdmin', '==', True) \
                            .where('excelUpdated', '==', False) \
-                           .limit(limit)
+                           .select(PENDING_CERT_FIELDS) \
+                           .order_by('__name__')
             
             results = []
             skip_reasons = {
@@ -219,66 +289,77 @@ def get_pending_certificates_debug(limit=50):
                 'data_error': 0
             }
             
-            processed_count = 0
-            for doc in final_query.stream():
-                if shutdown_flag or processed_count >= limit:
+            # 스트리밍 중에는 필드만 추출하고, 검증은 아래 루프에서 한 번에 처리
+            records = []
+            for doc in stream_pending_docs(final_query, limit):
+                if shutdown_flag or len(records) >= limit:
                     break
-                    
-                processed_count += 1
                 
                 try:
-                    data = doc.to_dict()
-                    
+                    data = doc.to_dict() or {}
+                    path_parts = doc.reference.path.split('/')
+                    records.append({
+                        'user_uid': path_parts[1] if len(path_parts) >= 4 else '',
+                        'cert_id': doc.id,
+                        'path_ok': len(path_parts) >= 4,
+                        'pdf_url': data.get('pdfUrl') or '',
+                        'retry_count': data.get('retryCount', 0),
+                        'data': data,
+                        'reference': doc.reference
+                    })
+                except Exception as e:
+                    skip_reasons['data_error'] += 1
+                    logger.debug(f"문서 처리 오류: {e}")
+            
+            processed_count = len(records) + skip_reasons['data_error']
+            
+            for record in records:
+                try:
                     # PDF URL 체크
-                    pdf_url = data.get('pdfUrl', '').strip()
-                    if not pdf_url:
+                    if not str(record['pdf_url']).strip():
                         skip_reasons['no_pdf_url'] += 1
                         continue
                     
                     # 재시도 횟수 체크
-                    retry_count = data.get('retryCount', 0)
+                    retry_count = record['retry_count'] or 0
                     if retry_count >= MAX_RETRY_COUNT:
                         skip_reasons['retry_exceeded'] += 1
                         # 재시도 카운터 리셋 옵션
-                        reset_enabled = os.getenv('RESET_HIGH_RETRY_COUNT', 'false').lower() == 'true'
-                        if reset_enabled and retry_count <= 10:
-                            logger.info(f"🔄 재시도 카운터 리셋: {doc.id[:12]}... (현재: {retry_count})")
-                            try:
-                                doc.reference.update({
-                                    'retryCount': 0,
-                                    'resetAt': firestore.SERVER_TIMESTAMP,
-                                    'resetReason': 'worker_reset'
-                                })
-                                # 리셋 후 계속 처리
-                            except Exception as reset_err:
-                                logger.debug(f"리셋 실패: {reset_err}")
-                                continue
-                        else:
+                        if not (RESET_HIGH_RETRY_COUNT and retry_count <= 10):
+                            continue
+                        logger.info(f"🔄 재시도 카운터 리셋: {record['cert_id'][:12]}... (현재: {retry_count})")
+                        try:
+                            record['reference'].update({
+                                'retryCount': 0,
+                                'resetAt': firestore.SERVER_TIMESTAMP,
+                                'resetReason': 'worker_reset'
+                            })
+                            # 리셋 후 계속 처리
+                        except Exception as reset_err:
+                            logger.debug(f"리셋 실패: {reset_err}")
                             continue
                     
-                    # 경로에서 UID 추출
-                    path_parts = doc.reference.path.split('/')
-                    if len(path_parts) < 4:
+                    # 경로에서 추출한 UID 체크
+                    if not record['path_ok']:
                         skip_reasons['path_error'] += 1
                         continue
                     
-                    user_uid = path_parts[1]
-                    cert_id = doc.id
+                    user_uid = record['user_uid']
+                    cert_id = record['cert_id']
                     
                     if not user_uid or not cert_id:
                         skip_reasons['data_error'] += 1
                         continue
                     
-                    results.append((user_uid, cert_id, data))
+                    results.append((user_uid, cert_id, record['data']))
                     
                     if len(results) <= 3:
-                        lecture_title = data.get('lectureTitle', '제목없음')
+                        lecture_title = record['data'].get('lectureTitle', '제목없음')
                         logger.info(f"✅ 처리 대상: {user_uid[:8]}.../{cert_id[:8]}... - {lecture_title[:30]}...")
                         
                 except Exception as e:
                     skip_reasons['data_error'] += 1
                     logger.debug(f"문서 처리 오류: {e}")
-                    continue
             
             # 결과 로깅
             logger.info(f"🎯 최종 결과:")
@@ -306,42 +387,88 @@ def get_pending_certificates_debug(limit=50):
             
         except Exception as e:
             logger.error(f"❌ 최종 쿼리 실패: {e}")
-            return []
+            return None
             
     except Exception as e:
         logger.error(f"❌ 수료증 조회 실패: {e}")
-        return []
+        return None
     finally:
         log_operation_end(operation_id)
 
+def user_info_from_snapshot(user_doc):
+    """사용자 문서 스냅샷 → 사용자 정보 dict"""
+    if not user_doc.exists:
+        return {'name': '', 'phone': '', 'email': ''}
+    
+    user_data = user_doc.to_dict()
+    return {
+        'name': user_data.get('name', ''),
+        'phone': user_data.get('phone', ''),
+        'email': user_data.get('email', '')
+    }
+
+# 사용자 정보 캐시 (일괄 조회/개별 조회 결과를 함께 저장, 조회 예외는 캐시하지 않음)
+# 없는 사용자는 수료증보다 사용자 문서가 늦게 생성되는 경우가 있어 별도 캐시에 짧게만 보관
+user_info_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+missing_user_cache = TTLCache(maxsize=256, ttl=MISSING_USER_CACHE_TTL_SECONDS)
+
+def cache_user_snapshot(user_doc):
+    """사용자 문서 스냅샷을 캐시에 저장하고 사용자 정보 반환"""
+    user_info = user_info_from_snapshot(user_doc)
+    if user_doc.exists:
+        user_info_cache[user_doc.id] = user_info
+    else:
+        missing_user_cache[user_doc.id] = user_info
+    return user_info
+
+def cached_user_info(user_uid):
+    """캐시된 사용자 정보 (없으면 None)"""
+    user_info = user_info_cache.get(user_uid)
+    if user_info is None:
+        user_info = missing_user_cache.get(user_uid)
+    return user_info
+
+def prefetch_user_info(user_uids):
+    """배치의 사용자 정보 조회 - 캐시에 없는 사용자만 get_all 한 번의 RPC로 조회 (실패 시 개별 조회로 대체)"""
+    user_infos = {}
+    missing_uids = []
+    for user_uid in user_uids:
+        cached = cached_user_info(user_uid)
+        if cached is None:
+            missing_uids.append(user_uid)
+        else:
+            user_infos[user_uid] = cached
+    
+    if not missing_uids:
+        return user_infos
+    
+    try:
+        refs = [db.collection('users').document(user_uid) for user_uid in missing_uids]
+        for snapshot in db.get_all(refs):
+            user_infos[snapshot.id] = cache_user_snapshot(snapshot)
+    except Exception as e:
+        logger.warning(f"⚠️ 사용자 정보 일괄 조회 실패, 개별 조회로 대체: {e}")
+    
+    return user_infos
+
+def denormalized_user_info(cert_data):
+    """수료증에 복사된 사용자 정보 (없으면 None)"""
+    if 'userName' not in cert_data:
+        return None
+    return {
+        'name': cert_data.get('userName') or '',
+        'phone': cert_data.get('userPhone') or '',
+        'email': cert_data.get('userEmail') or ''
+    }
+
 def get_user_info(user_uid):
     """사용자 정보 조회 (캐싱)"""
-    if not hasattr(get_user_info, 'cache'):
-        get_user_info.cache = {}
-    
-    if user_uid in get_user_info.cache:
-        return get_user_info.cache[user_uid]
+    user_info = cached_user_info(user_uid)
+    if user_info is not None:
+        return user_info
     
     try:
-        user_doc = db.collection('users').document(user_uid).get()
-        
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            user_info = {
-                'name': user_data.get('name', ''),
-                'phone': user_data.get('phone', ''),
-                'email': user_data.get('email', '')
-            }
-            
-            if len(get_user_info.cache) < 1000:
-                get_user_info.cache[user_uid] = user_info
-            
-            return user_info
-        else:
-            empty_info = {'name': '', 'phone': '', 'email': ''}
-            get_user_info.cache[user_uid] = empty_info
-            return empty_info
-            
+        return cache_user_snapshot(db.collection('users').document(user_uid).get())
     except Exception as e:
         logger.debug(f"사용자 정보 조회 실패: {e}")
         return {'name': '', 'phone': '', 'email': ''}
@@ -349,43 +476,103 @@ def get_user_info(user_uid):
 # ===================================================================
 # Excel 처리 함수들
 # ===================================================================
+class MasterCache:
+    """마스터 데이터 메모리 캐시 (이 워커가 유일한 작성자이므로 generation이 같으면 재사용)"""
+    df = None
+    generation = None
+    pending_exports = 0  # 마지막 xlsx 내보내기 이후 저장된 배치 수
+    cached_at = 0.0  # time.monotonic() 기준 캐시 시각 (TTL 확인용)
+    downloaded_at = 0.0  # time.monotonic() 기준 마지막 Storage 다운로드 시각 (강제 재다운로드 확인용)
+    parquet_generation = None  # 저장 시 if_generation_match 로 쓸 parquet generation (0 = 파일이 없어야 함, None = 기존 마스터를 읽지 못해 저장 금지)
+
+def read_master_workbook(excel_bytes):
+    """xlsx 바이트 → DataFrame (calamine 우선, 없으면 openpyxl read_only)"""
+    try:
+        # calamine: Rust 기반 파서 (openpyxl 대비 ~10배 빠름, pandas>=2.2 + python-calamine 필요)
+        # dtype=str: '010...' 전화번호가 숫자로 바뀌지 않도록 문자열 그대로 유지
+        return pd.read_excel(io.BytesIO(excel_bytes), engine='calamine', dtype=str).dropna(how='all')
+    except (ImportError, ValueError) as e:
+        logger.debug(f"calamine 사용 불가, openpyxl로 읽기: {e}")
+    
+    # read_only 모드: 셀 객체를 만들지 않고 행 값만 스트리밍 (외부 링크 캐시는 읽지 않음)
+    workbook = load_workbook(io.BytesIO(excel_bytes), read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, ())
+        return pd.DataFrame(rows, columns=header).dropna(how='all')
+    finally:
+        workbook.close()
+
+def read_master_parquet(parquet_bytes):
+    """parquet 바이트 → DataFrame (pd.NA는 xlsx 경로와 같이 None으로 통일)"""
+    df = pd.read_parquet(io.BytesIO(parquet_bytes)).astype(object)
+    return df.where(df.notna(), None)
+
 def load_master_excel():
-    """마스터 엑셀 로드"""
+    """마스터 엑셀 로드 (메모리 캐시 우선)"""
     operation_id = f"load_excel_{int(time.time())}"
     log_operation_start(operation_id)
     
     try:
+        # 이 워커가 유일한 작성자이므로 TTL 이내에는 메타데이터 조회도 생략 (저장 실패 시 캐시는 무효화됨)
+        # 저장할 때마다 cached_at이 갱신되므로, 강제 재다운로드 시각은 마지막 다운로드 기준으로 따로 확인
+        now = time.monotonic()
+        download_fresh = now - MasterCache.downloaded_at < MASTER_FORCE_RELOAD_SECONDS
+        if MasterCache.df is not None and now - MasterCache.cached_at < MASTER_CACHE_TTL_SECONDS and download_fresh:
+            logger.info(f"♻️ 캐시된 엑셀 사용 (행 수: {len(MasterCache.df)})")
+            # 얕은 복사: 배치는 concat으로 새 프레임을 만들 뿐 기존 값을 수정하지 않으므로 전체 복사 불필요
+            return MasterCache.df.copy(deep=False)
+        
+        # 로드에 실패해 빈 프레임을 돌려줄 때 기존 마스터(parquet 또는 전환 전 xlsx)를 덮어쓰지 않도록
+        # 읽기에 성공했거나 파일이 아예 없을 때만 generation 기록 (그 외에는 None으로 두어 저장 차단)
+        MasterCache.parquet_generation = None
+        
         # 🔧 올바른 버킷으로 Firebase Storage에서 로드
         try:
-            logger.info(f"📥 Firebase Storage에서 엑셀 로드 시도: {FIREBASE_STORAGE_BUCKET}/{MASTER_FILENAME}")
-            master_blob = bucket.blob(MASTER_FILENAME)
+            logger.info(f"📥 Firebase Storage에서 마스터 로드 시도: {FIREBASE_STORAGE_BUCKET}/{MASTER_PARQUET_FILENAME}")
+            # 메타데이터만 조회 (파일 존재 확인 + generation)
+            # parquet이 아직 없으면 (전환 전) 기존 xlsx에서 로드 → 다음 저장 때 parquet 생성
+            parquet_blob = bucket.get_blob(MASTER_PARQUET_FILENAME)
+            master_blob = parquet_blob or bucket.get_blob(MASTER_FILENAME)
             
-            # 파일 존재 확인
-            if not master_blob.exists():
+            if master_blob is None:
                 logger.info("⚠️ 마스터 엑셀 파일이 존재하지 않음, 새로 생성")
+                MasterCache.parquet_generation = 0
                 return create_empty_dataframe()
             
+            if MasterCache.df is not None and master_blob.generation == MasterCache.generation and download_fresh:
+                logger.info(f"♻️ 캐시된 엑셀 사용 (generation: {master_blob.generation}, 행 수: {len(MasterCache.df)})")
+                MasterCache.cached_at = time.monotonic()
+                MasterCache.parquet_generation = parquet_blob.generation if parquet_blob is not None else 0
+                return MasterCache.df.copy(deep=False)
+            
             existing_bytes = master_blob.download_as_bytes()
             logger.info(f"📥 파일 다운로드 완료: {len(existing_bytes)} bytes")
             
-            excel_buffer = io.BytesIO(existing_bytes)
-            df = pd.read_excel(excel_buffer, engine='openpyxl')
-            
-            expected_columns = [
-                '업데이트 날짜', '사용자 UID', '전화번호', '이메일', 
-                '사용자 이름', '강의 제목', '발급 일시', 'PDF URL'
-            ]
+            if parquet_blob is not None:
+                df = read_master_parquet(existing_bytes)
+            else:
+                df = read_master_workbook(existing_bytes)
             
-            if not all(col in df.columns for col in expected_columns):
+            if not all(col in df.columns for col in MASTER_COLUMNS):
                 logger.warning("⚠️ 엑셀 컬럼 구조 이상, 새로 생성")
+                MasterCache.parquet_generation = parquet_blob.generation if parquet_blob is not None else 0
                 return create_empty_dataframe()
             
             if len(df) > 15000:
                 logger.warning("⚠️ 데이터 크기 제한으로 최근 10,000행만 유지")
-                df = df.tail(10000).reset_index(drop=True)
+                # iloc 슬라이스 + inplace 인덱스 재설정 (tail().reset_index()의 추가 복사 방지)
+                df = df.iloc[-10000:]
+                df.reset_index(drop=True, inplace=True)
+            
+            MasterCache.df = df
+            MasterCache.generation = master_blob.generation
+            MasterCache.cached_at = time.monotonic()
+            MasterCache.downloaded_at = MasterCache.cached_at
+            MasterCache.parquet_generation = parquet_blob.generation if parquet_blob is not None else 0
             
             logger.info(f"✅ 엑셀 로드 완료 (행 수: {len(df)})")
-            return df
+            return df.copy(deep=False)
             
         except Exception as firebase_error:
             logger.warning(f"⚠️ Firebase Storage 로드 실패: {firebase_error}")
@@ -400,83 +587,167 @@ def load_master_excel():
 
 def create_empty_dataframe():
     """빈 DataFrame 생성"""
-    return pd.DataFrame(columns=[
-        '업데이트 날짜',
-        '사용자 UID',
-        '전화번호',
-        '이메일',
-        '사용자 이름',
-        '강의 제목',
-        '발급 일시',
-        'PDF URL'
-    ])
+    return pd.DataFrame(columns=MASTER_COLUMNS)
+
+def gzip_if_smaller(payload):
+    """gzip(레벨 1) 압축이 충분히 이득일 때만 압축본 반환 (xlsx는 이미 ZIP이라 대부분 원본 유지)"""
+    compressed = gzip.compress(payload, compresslevel=1)
+    if len(compressed) <= len(payload) * (1 - GZIP_MIN_SAVING_RATIO):
+        return compressed, 'gzip'
+    return payload, None
+
+def write_master_workbook(df, out_buffer):
+    """마스터 DataFrame을 xlsx로 기록 (pandas ExcelWriter 없이 행 단위로 직접 기록)"""
+    # 행 순서대로 write_row 하므로 constant_memory 사용 가능 (pandas to_excel은 열 단위라 불가)
+    # in_memory 옵션은 constant_memory를 꺼버리므로 함께 쓰지 않음 (1.5만 행 기준 최대 메모리 ~30MB → ~2MB)
+    # URL/수식 자동 변환은 끔 - PDF URL 열이 하이퍼링크로 바뀌지 않도록
+    workbook = xlsxwriter.Workbook(out_buffer, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    worksheet = workbook.add_worksheet('Certificates')
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    worksheet.write_row(0, 0, list(df.columns), header_format)
+    
+    # 빈 값(NaN/None)은 ''로 → 빈 셀로 기록 (xlsxwriter는 NaN 숫자를 쓸 수 없음)
+    for row_idx, row in enumerate(df.fillna('').itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, row)
+    
+    workbook.close()
+
+def upload_master_blob(filename, payload, content_type, content_encoding=None, if_generation_match=None):
+    """Storage 업로드 (최대 3회 시도, 성공 시 blob 반환 / 실패 시 None)"""
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"📤 Firebase Storage 업로드 시도 {attempt + 1}/{max_retries}: {FIREBASE_STORAGE_BUCKET}/{filename}")
+            
+            master_blob = bucket.blob(filename)
+            # Content-Encoding: gzip 이면 다운로드 시 자동으로 압축 해제됨
+            master_blob.content_encoding = content_encoding
+            
+            # 8MB 이하는 chunk_size와 무관하게 멀티파트 요청 1번으로 업로드됨 (chunk_size 지정 불필요)
+            master_blob.upload_from_string(
+                payload,
+                content_type=content_type,
+                timeout=UPLOAD_TIMEOUT_SECONDS,
+                if_generation_match=if_generation_match
+            )
+            return master_blob
+            
+        except PreconditionFailed:
+            # 다른 작성자(배포 중 겹친 워커 등)가 먼저 저장함 → 재시도해도 같으므로 바로 실패 처리
+            logger.warning(f"⚠️ {filename} 이(가) 로드 이후 변경됨 - 덮어쓰지 않고 다음 배치에서 다시 로드")
+            return None
+            
+        except Exception as e:
+            logger.warning(f"⚠️ 업로드 실패 (시도 {attempt + 1}/{max_retries}): {e}")
+            if 'bucket does not exist' in str(e).lower():
+                logger.error(f"❌ Storage 버킷이 존재하지 않음: {FIREBASE_STORAGE_BUCKET}")
+                logger.error("💡 해결 방법:")
+                logger.error("   1. Firebase Console → Storage → Get started")
+                logger.error(f"   2. 환경변수 확인: FIREBASE_STORAGE_BUCKET={FIREBASE_STORAGE_BUCKET}")
+            
+            if attempt < max_retries - 1:
+                # 지수 백오프 + 지터 (여러 워커가 같은 시각에 다시 몰리지 않도록)
+                time.sleep(random.uniform(1, 2 ** (attempt + 1)))
+    
+    return None
+
+def export_master_xlsx(df):
+    """관리자용 마스터 엑셀(xlsx) 내보내기"""
+    operation_id = f"export_excel_{int(time.time())}"
+    log_operation_start(operation_id)
+    
+    try:
+        out_buffer = io.BytesIO()
+        write_master_workbook(df, out_buffer)
+        out_buffer.seek(0)
+        
+        # 바이트는 한 번만 꺼내서 gzip/업로드/백업에 같이 사용
+        xlsx_bytes = out_buffer.getvalue()
+        upload_bytes, content_encoding = gzip_if_smaller(xlsx_bytes)
+        if content_encoding:
+            logger.info(f"🗜️ gzip 업로드: {len(xlsx_bytes)} → {len(upload_bytes)} bytes")
+        
+        if upload_master_blob(MASTER_FILENAME, upload_bytes, XLSX_CONTENT_TYPE, content_encoding) is None:
+            # 업로드가 끝내 실패한 경우에만 로컬 백업 (고정 파일명 - 실패가 반복돼도 /tmp에 파일이 쌓이지 않음)
+            try:
+                with open(LOCAL_BACKUP_PATH, 'wb') as f:
+                    f.write(xlsx_bytes)
+                logger.info(f"💾 로컬 백업 저장: {LOCAL_BACKUP_PATH}")
+            except Exception:
+                logger.debug("로컬 백업 실패")
+            
+            logger.error("❌ 엑셀 내보내기 실패 - 다음 배치에서 재시도")
+            return False
+        
+        logger.info(f"✅ 엑셀 내보내기 완료 (총 {len(df)}행): {FIREBASE_STORAGE_BUCKET}/{MASTER_FILENAME}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ 엑셀 내보내기 중 예외: {e}")
+        return False
+    finally:
+        log_operation_end(operation_id)
+
+def flush_master_export():
+    """아직 xlsx로 내보내지 않은 저장분이 있으면 내보내기 (대기 중/종료 시 호출)"""
+    if MasterCache.pending_exports > 0 and MasterCache.df is not None:
+        if export_master_xlsx(MasterCache.df):
+            MasterCache.pending_exports = 0
 
 def save_master_excel(df):
-    """마스터 엑셀 저장"""
+    """마스터 데이터 저장 (parquet은 매 배치, xlsx는 N배치마다 내보내기)"""
     operation_id = f"save_excel_{int(time.time())}"
     log_operation_start(operation_id)
     
     try:
         if len(df) > 20000:
             logger.warning("⚠️ 저장 크기 제한으로 최근 15,000행만 저장")
-            df = df.tail(15000).reset_index(drop=True)
+            df = df.iloc[-15000:]
+            df.reset_index(drop=True, inplace=True)
         
-        out_buffer = io.BytesIO()
-        with pd.ExcelWriter(out_buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Certificates')
-        out_buffer.seek(0)
+        # parquet(zstd): xlsx(XML+ZIP) 직렬화보다 훨씬 빠르고 작음
+        # 'string' 변환 - 예전 xlsx에서 읽은 숫자/문자 혼합 열도 한 타입으로 저장
+        if MasterCache.parquet_generation is None:
+            logger.error("❌ 기존 마스터를 읽지 못해 저장 중단 (덮어쓰면 이력이 사라짐) - 다음 배치에서 다시 로드")
+            return False
         
-        # 로컬 백업
-        backup_path = Path(f'/tmp/backup_{int(time.time())}.xlsx')
-        try:
-            with open(backup_path, 'wb') as f:
-                f.write(out_buffer.getvalue())
-            logger.info("💾 로컬 백업 완료")
-        except Exception:
-            logger.debug("로컬 백업 실패")
+        parquet_buffer = io.BytesIO()
+        df.astype('string').to_parquet(parquet_buffer, engine='pyarrow', compression='zstd', index=False)
         
-        # 🔧 올바른 버킷으로 Firebase Storage 업로드
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                out_buffer.seek(0)
-                logger.info(f"📤 Firebase Storage 업로드 시도 {attempt + 1}/{max_retries}: {FIREBASE_STORAGE_BUCKET}/{MASTER_FILENAME}")
-                
-                master_blob = bucket.blob(MASTER_FILENAME)
-                
-                master_blob.upload_from_file(
-                    out_buffer,
-                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-                
-                logger.info(f"✅ 엑셀 저장 완료 (총 {len(df)}행)")
-                logger.info(f"✅ Firebase Storage 경로: {FIREBASE_STORAGE_BUCKET}/{MASTER_FILENAME}")
-                
-                # 백업 파일 정리
-                try:
-                    backup_path.unlink()
-                except Exception:
-                    pass
-                
-                return True
-                
-            except Exception as e:
-                logger.warning(f"⚠️ 엑셀 저장 실패 (시도 {attempt + 1}/{max_retries}): {e}")
-                if 'bucket does not exist' in str(e).lower():
-                    logger.error(f"❌ Storage 버킷이 존재하지 않음: {FIREBASE_STORAGE_BUCKET}")
-                    logger.error("💡 해결 방법:")
-                    logger.error("   1. Firebase Console → Storage → Get started")
-                    logger.error(f"   2. 환경변수 확인: FIREBASE_STORAGE_BUCKET={FIREBASE_STORAGE_BUCKET}")
-                
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                else:
-                    return False
+        # if_generation_match: 로드한 뒤 다른 워커가 저장했다면 덮어쓰지 않음 (쓰기 유실 방지)
+        master_blob = upload_master_blob(
+            MASTER_PARQUET_FILENAME,
+            parquet_buffer.getvalue(),
+            PARQUET_CONTENT_TYPE,
+            if_generation_match=MasterCache.parquet_generation
+        )
+        if master_blob is None:
+            # 업로드 결과가 불확실하므로 캐시를 버리고 다음 배치에서 Storage 기준으로 다시 로드
+            MasterCache.df = None
+            MasterCache.generation = None
+            MasterCache.parquet_generation = None
+            return False
         
-        return False
+        MasterCache.df = df
+        MasterCache.generation = master_blob.generation
+        MasterCache.parquet_generation = master_blob.generation
+        MasterCache.cached_at = time.monotonic()
+        MasterCache.pending_exports += 1
+        
+        logger.info(f"✅ 마스터 저장 완료 (총 {len(df)}행): {FIREBASE_STORAGE_BUCKET}/{MASTER_PARQUET_FILENAME}")
+        
+        # xlsx는 N배치마다 (또는 대기 상태가 되면 flush_master_export로) 내보냄 - 실패해도 다음에 다시 시도
+        if MasterCache.pending_exports >= XLSX_EXPORT_EVERY_N_BATCHES:
+            flush_master_export()
+        
+        return True
         
     except Exception as e:
-        logger.error(f"❌ 엑셀 저장 중 예외: {e}")
+        logger.error(f"❌ 마스터 저장 중 예외: {e}")
         return False
     finally:
         log_operation_end(operation_id)
@@ -484,10 +755,12 @@ def save_master_excel(df):
 # ===================================================================
 # 수료증 처리 함수들
 # ===================================================================
-def process_certificate(user_uid, cert_id, cert_data, df):
+def process_certificate(user_uid, cert_id, cert_data, user_cache, seen, new_rows, batch_stamp):
     """단일 수료증 처리"""
+    # seen/new_rows는 배치 전체가 공유 (중복 키와 새 행을 여기에 추가, 병합은 배치 끝에서 한 번)
     try:
-        user_info = get_user_info(user_uid)
+        # 발급 시 복사된 사용자 정보가 있으면 users 문서를 조회하지 않음 (예전 문서만 조회로 대체)
+        user_info = denormalized_user_info(cert_data) or user_cache.get(user_uid) or get_user_info(user_uid)
         
         lecture_title = cert_data.get('lectureTitle', cert_id)
         pdf_url = cert_data.get('pdfUrl', '')
@@ -499,35 +772,29 @@ def process_certificate(user_uid, cert_id, cert_data, df):
         if hasattr(issued_at, 'to_datetime'):
             issued_str = issued_at.to_datetime().strftime('%Y-%m-%d %H:%M:%S')
         else:
-            issued_str = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 중복 확인
-        existing_mask = (
-            (df['사용자 UID'] == user_uid) & 
-            (df['강의 제목'] == lecture_title) & 
-            (df['PDF URL'] == pdf_url)
-        )
+            issued_str = batch_stamp
         
-        if existing_mask.any():
+        # 중복 확인 (O(1) 집합 조회)
+        dedup_key = (user_uid, lecture_title, pdf_url)
+        if dedup_key in seen:
             logger.info(f"⚠️ 중복 수료증 스킵: {user_uid[:8]}.../{lecture_title[:20]}...")
-            return True, df
-        
-        updated_date = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        new_row = pd.DataFrame([{
-            '업데이트 날짜': updated_date,
-            '사용자 UID': user_uid,
-            '전화번호': user_info['phone'],
-            '이메일': user_info['email'],
-            '사용자 이름': user_info['name'],
-            '강의 제목': lecture_title,
-            '발급 일시': issued_str,
-            'PDF URL': pdf_url
-        }])
-        
-        df = pd.concat([df, new_row], ignore_index=True)
+            return True
+        
+        # MASTER_COLUMNS 순서의 튜플 (행마다 dict를 만들지 않고 배치 끝에서 열 이름을 한 번만 지정)
+        new_rows.append((
+            batch_stamp,
+            user_uid,
+            user_info['phone'],
+            user_info['email'],
+            user_info['name'],
+            lecture_title,
+            issued_str,
+            pdf_url
+        ))
+        seen.add(dedup_key)
         
         logger.info(f"✅ 수료증 처리 완료: {user_uid[:8]}.../{cert_id[:8]}... - {lecture_title[:30]}...")
-        return True, df
+        return True
         
     except Exception as e:
         logger.warning(f"⚠️ 수료증 처리 실패 ({user_uid[:8]}.../{cert_id[:8]}...): {e}")
@@ -543,95 +810,169 @@ def process_certificate(user_uid, cert_id, cert_data, df):
         except Exception:
             pass
         
-        return False, df
+        return False
+
+def build_certificate_flag_update(cert_data, success=True):
+    """수료증 플래그 업데이트 데이터 생성"""
+    if success:
+        update_data = {
+            'excelUpdated': True,
+            'processedAt': firestore.SERVER_TIMESTAMP,
+            'processedBy': 'fixed_storage_worker_v1',
+            'workerProcessed': True
+        }
+        
+        if 'processingError' in cert_data:
+            update_data['processingError'] = firestore.DELETE_FIELD
+        if 'readyForExcel' in cert_data:
+            update_data['readyForExcel'] = False
+        
+        return update_data
+    
+    return {
+        'excelSaveError': True,
+        'excelSaveErrorAt': firestore.SERVER_TIMESTAMP,
+        'retryCount': firestore.Increment(1)
+    }
 
 def update_certificate_flags_batch(processed_certs, success=True):
-    """배치 플래그 업데이트"""
+    """배치 플래그 업데이트 (Firestore WriteBatch로 한 번에 커밋)"""
     operation_id = f"update_flags_{int(time.time())}"
     log_operation_start(operation_id)
     
     try:
-        def update_single_flag(cert_info):
-            user_uid, cert_id, cert_data = cert_info
-            try:
+        updated_count = 0
+        
+        # WriteBatch 한 번에 최대 500개까지 커밋 가능
+        for start in range(0, len(processed_certs), FIRESTORE_BATCH_LIMIT):
+            chunk = processed_certs[start:start + FIRESTORE_BATCH_LIMIT]
+            updates = []
+            write_batch = db.batch()
+            
+            for user_uid, cert_id, cert_data in chunk:
                 cert_ref = db.collection('users').document(user_uid) \
                              .collection('completedCertificates').document(cert_id)
-                
-                if success:
-                    update_data = {
-                        'excelUpdated': True,
-                        'processedAt': firestore.SERVER_TIMESTAMP,
-                        'processedBy': 'fixed_storage_worker_v1',
-                        'workerProcessed': True
-                    }
-                    
-                    if 'processingError' in cert_data:
-                        update_data['processingError'] = firestore.DELETE_FIELD
-                    if 'readyForExcel' in cert_data:
-                        update_data['readyForExcel'] = False
-                    
-                    cert_ref.update(update_data)
-                    return "✅"
-                    
-                else:
-                    cert_ref.update({
-                        'excelSaveError': True,
-                        'excelSaveErrorAt': firestore.SERVER_TIMESTAMP,
-                        'retryCount': firestore.Increment(1)
-                    })
-                    return "⚠️"
-                    
+                update_data = build_certificate_flag_update(cert_data, success)
+                updates.append((cert_ref, update_data))
+                write_batch.update(cert_ref, update_data)
+            
+            try:
+                write_batch.commit()
+                updated_count += len(chunk)
             except Exception as e:
-                logger.debug(f"플래그 업데이트 실패: {e}")
-                return "❌"
+                # 배치는 원자적이라 문서 하나(삭제됨 등)만 문제여도 전체가 실패 → 해당 묶음만 개별 업데이트
+                logger.warning(f"⚠️ 플래그 배치 커밋 실패 ({len(chunk)}개), 개별 업데이트로 재시도: {e}")
+                for cert_ref, update_data in updates:
+                    try:
+                        cert_ref.update(update_data)
+                        updated_count += 1
+                    except Exception as doc_error:
+                        logger.warning(f"⚠️ 플래그 업데이트 실패 ({cert_ref.id}): {doc_error}")
         
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(update_single_flag, processed_certs))
-        
-        success_count = sum(1 for r in results if r == '✅')
-        logger.info(f"✅ 플래그 업데이트: {success_count}/{len(results)}")
+        # 저장 실패 시 커밋한 것은 완료 표시가 아니라 오류/재시도 카운트 기록이므로 따로 로깅
+        if success:
+            logger.info(f"✅ 플래그 업데이트: {updated_count}/{len(processed_certs)}")
+        else:
+            logger.warning(f"⚠️ 저장 실패 기록 (재시도 카운트 증가): {updated_count}/{len(processed_certs)}")
         
     except Exception as e:
         logger.error(f"❌ 배치 플래그 업데이트 실패: {e}")
     finally:
         log_operation_end(operation_id)
 
+# ===================================================================
+# 실시간 대기 수료증 감지
+# ===================================================================
+work_available = threading.Event()
+
+def on_pending_snapshot(docs, changes, read_time):
+    """대기 수료증 쿼리 스냅샷 콜백 - 새로 대기 상태가 된 문서가 있으면 워커를 깨움"""
+    # MODIFIED(재시도 카운트 증가 등)/REMOVED(처리 완료)는 이 워커 자신의 쓰기라 무시
+    if any(change.type.name == 'ADDED' for change in changes):
+        work_available.set()
+
+def start_pending_listener():
+    """대기 수료증 실시간 리스너 시작 (실패 시 None → 폴링 간격으로 동작)"""
+    try:
+        pending_query = db.collection_group('completedCertificates') \
+                          .where('sentToAdmin', '==', True) \
+                          .where('excelUpdated', '==', False)
+        watch = pending_query.on_snapshot(on_pending_snapshot)
+        logger.info("👂 대기 수료증 실시간 리스너 시작")
+        return watch
+    except Exception as e:
+        logger.warning(f"⚠️ 실시간 리스너 시작 실패, 폴링으로 동작: {e}")
+        return None
+
 # ===================================================================
 # 배치 처리
 # ===================================================================
 def process_batch():
-    """배치 처리 실행"""
+    """배치 처리 실행 (조회된 대기 수료증 수, 성공 여부 반환)"""
     operation_id = f"batch_{int(time.time())}"
     log_operation_start(operation_id)
+    # 실패한 배치는 같은 페이지부터 다시 처리하도록 조회 전 커서 보관
+    cursor_before = PendingCursor.last_doc
     
     try:
         batch_start_time = datetime.now(timezone.utc)
         
+        # 마스터 엑셀 다운로드를 먼저 띄워두고, 그동안 수료증 조회 → 사용자 정보 일괄 조회를 진행
+        # (Storage 다운로드, Firestore 쿼리, 사용자 조회의 네트워크 대기를 한 번에 겹쳐서 처리)
+        df_future = master_load_pool.submit(load_master_excel)
         pending_certs = get_pending_certificates_debug(limit=BATCH_SIZE)
         
+        if pending_certs is None:
+            PendingCursor.last_doc = cursor_before
+            return 0, False
+        
         if not pending_certs:
             logger.info("😴 처리할 수료증이 없습니다 - 상세 분석 완료")
-            return
+            flush_master_export()  # 한가할 때 밀린 xlsx 내보내기
+            return 0, True
         
         logger.info(f"🚀 {len(pending_certs)}개 수료증 배치 처리 시작")
         
-        df = load_master_excel()
+        unique_uids = list({user_uid for user_uid, _, cert_data in pending_certs
+                            if denormalized_user_info(cert_data) is None})
+        user_cache = prefetch_user_info(unique_uids)
+        
+        # 배치 내 모든 행이 같은 업데이트 시각을 공유 (행마다 strftime 하지 않음)
+        batch_stamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        
+        df = df_future.result()
+        
         original_row_count = len(df)
         
+        # 중복 확인용 키 집합 (배치당 1회 생성)
+        seen = set(zip(df['사용자 UID'].values, df['강의 제목'].values, df['PDF URL'].values))
+        
         success_count = 0
         error_count = 0
         processed_certs = []
+        new_rows = []
+        # 시그널 타이머 대신 단조 시계로 배치 전체 시간 한도를 확인 (남은 수료증은 다음 배치에서 처리)
+        deadline = time.monotonic() + BATCH_DEADLINE_SECONDS
         
         for i, (user_uid, cert_id, cert_data) in enumerate(pending_certs, 1):
+            # 중간에 멈추면 커서를 조회 전 위치로 되돌려 남은 수료증을 건너뛰지 않음
+            # (이미 처리한 문서는 플래그가 갱신되어 다음 조회에서 빠짐)
             if shutdown_flag:
                 logger.info("🛑 종료 플래그 감지, 배치 처리 중단")
+                PendingCursor.last_doc = cursor_before
+                break
+            
+            if time.monotonic() > deadline:
+                logger.warning(f"⏱️ 배치 시간 한도({BATCH_DEADLINE_SECONDS}초) 초과 - 남은 {len(pending_certs) - i + 1}개는 다음 배치에서 처리")
+                PendingCursor.last_doc = cursor_before
+                work_available.set()  # 대기하지 않고 바로 다시 조회 (새 수료증 알림과 같이 한 바퀴 조회로 처리)
                 break
             
             if len(pending_certs) > 5 and i % max(1, len(pending_certs) // 5) == 0:
                 progress = (i / len(pending_certs)) * 100
                 logger.info(f"📊 처리 진행률: {progress:.0f}% ({i}/{len(pending_certs)})")
             
-            success, df = process_certificate(user_uid, cert_id, cert_data, df)
+            success = process_certificate(user_uid, cert_id, cert_data, user_cache, seen, new_rows, batch_stamp)
             
             if success:
                 success_count += 1
@@ -640,6 +981,10 @@ def process_batch():
                 error_count += 1
         
         if success_count > 0:
+            # 새 행은 배치 끝에서 한 번만 병합 (행마다 concat 하면 전체 복사가 반복됨)
+            if new_rows:
+                df = pd.concat([df, pd.DataFrame.from_records(new_rows, columns=MASTER_COLUMNS)], ignore_index=True)
+            
             new_row_count = len(df)
             logger.info(f"📊 Excel 저장: {original_row_count}행 → {new_row_count}행 (+{new_row_count - original_row_count})")
             
@@ -652,11 +997,17 @@ def process_batch():
                 logger.info(f"🎉 배치 처리 완료 - ✅성공: {success_count}, ❌실패: {error_count}, ⏱️시간: {processing_time:.1f}초")
             else:
                 logger.error(f"❌ Excel 저장 실패 - 재시도 예정")
+                PendingCursor.last_doc = cursor_before
+                return len(pending_certs), False
         else:
             logger.info(f"📊 배치 처리 완료 - 성공적으로 처리된 항목 없음 (❌실패: {error_count})")
         
+        return len(pending_certs), True
+        
     except Exception as e:
         logger.error(f"❌ 배치 처리 중 오류: {e}")
+        PendingCursor.last_doc = cursor_before
+        return 0, False
     finally:
         log_operation_end(operation_id)
 
@@ -682,20 +1033,34 @@ def update_health_status():
 # ===================================================================
 # 메인 워커 루프
 # ===================================================================
+def wait_with_backoff(backoff):
+    """지터를 섞은 백오프 대기 후 다음 백오프 값 반환 (종료 신호가 오면 즉시 중단)"""
+    # 장애가 이어지면 대기 시간을 두 배씩 늘리고 지터를 섞어 요청이 한꺼번에 몰리지 않도록 함
+    sleep_time = random.uniform(1, backoff)
+    logger.warning(f"⏳ {sleep_time:.0f}초 후 재시도")
+    wait_until = time.monotonic() + sleep_time
+    while not shutdown_flag and time.monotonic() < wait_until:
+        time.sleep(1)
+    return min(ERROR_BACKOFF_MAX_SECONDS, backoff * 2)
+
 def run_worker():
     """메인 워커 루프"""
     logger.info(f"🚀 Certificate Worker v3.3 시작 (Storage 버킷 문제 해결)")
     logger.info(f"⏱️ 폴링 간격: {POLL_INTERVAL_SECONDS}초")
     logger.info(f"📦 배치 크기: {BATCH_SIZE}")
     logger.info(f"🔄 최대 재시도: {MAX_RETRY_COUNT}")
-    logger.info(f"🔧 재시도 리셋: {os.getenv('RESET_HIGH_RETRY_COUNT', 'false')}")
+    logger.info(f"🔧 재시도 리셋: {RESET_HIGH_RETRY_COUNT}")
     logger.info(f"🪣 Storage 버킷: {FIREBASE_STORAGE_BUCKET}")
     
     update_health_status()
     
+    pending_watch = start_pending_listener()
+    
     iteration = 0
     last_activity_time = None
-    consecutive_empty_batches = 0
+    idle_poll_interval = POLL_INTERVAL_SECONDS
+    error_backoff = POLL_INTERVAL_SECONDS
+    full_scan = False  # 실시간 알림으로 시작한 한 바퀴 조회가 진행 중인지
     
     while not shutdown_flag:
         try:
@@ -711,35 +1076,77 @@ def run_worker():
                 time.sleep(5)
                 continue
             
-            # 배치 처리
-            process_batch()
+            # 새 수료증 알림: 새 문서가 커서 앞쪽에 들어왔을 수 있으므로 처음부터 끝까지 한 바퀴 조회
+            # (조회 중 도착한 알림은 비우지 않고 두었다가 이번 바퀴가 끝나면 다음 바퀴로 처리)
+            if not full_scan and work_available.is_set():
+                work_available.clear()
+                PendingCursor.last_doc = None
+                full_scan = True
+            
+            fetched_count, batch_ok = process_batch()
+            
+            # 조회/저장 실패는 빈 폴링이 아니라 장애로 보고 백오프 후 같은 페이지부터 재시도
+            if not batch_ok:
+                error_backoff = wait_with_backoff(error_backoff)
+                continue
+            error_backoff = POLL_INTERVAL_SECONDS
             
-            consecutive_empty_batches += 1
+            # 적응형 폴링 간격: 처리할 문서가 있었으면 기본값으로, 빈 폴링이면 두 배씩 늘림
+            if fetched_count > 0:
+                idle_poll_interval = POLL_INTERVAL_SECONDS
+            else:
+                idle_poll_interval = min(IDLE_POLL_MAX_SECONDS, idle_poll_interval * 2)
             
             # 상태 로깅
             if iteration % 10 == 0:
                 logger.info(f"📈 상태 - 반복: {iteration}, 활성작업: {len(current_operations)}개, 버킷: {FIREBASE_STORAGE_BUCKET}")
             
-            # 동적 대기 시간
-            if consecutive_empty_batches > 10:
-                sleep_time = min(POLL_INTERVAL_SECONDS * 2, 120)
+            # 끝까지 읽어 커서가 초기화되면 알림으로 시작한 한 바퀴 조회도 끝
+            if PendingCursor.last_doc is None:
+                full_scan = False
+            
+            # 알림으로 한 바퀴 조회 중이거나, 이번 페이지에 처리할 문서가 있었고 뒤에 더 있으면 바로 다음 페이지 처리
+            # (타이머로 깨어나 스킵 문서만 나온 페이지면 대기 - 커서는 유지되므로 다음에는 이어서 한 페이지만 조회)
+            if PendingCursor.last_doc is not None and (full_scan or fetched_count > 0):
+                continue
+            
+            # 리스너가 끊겼으면 재시작 시도
+            if pending_watch is not None and not pending_watch.is_active:
+                logger.warning("⚠️ 실시간 리스너 중단됨, 재시작")
+                pending_watch = start_pending_listener()
+            
+            # 동적 대기 시간 (리스너 동작 중이면 폴링은 안전망 역할만)
+            if pending_watch is not None:
+                sleep_time = LISTENER_FALLBACK_POLL_SECONDS
             else:
-                sleep_time = POLL_INTERVAL_SECONDS
+                sleep_time = idle_poll_interval
             
-            # 인터럽트 가능한 대기
+            # 인터럽트 가능한 대기 (새 수료증 알림이 오면 즉시 깨어남)
             for _ in range(sleep_time):
-                if shutdown_flag:
+                if shutdown_flag or work_available.wait(1):
                     break
-                time.sleep(1)
+            
+            # 알림이 몰려올 때 한 배치로 묶이도록 잠깐 모은 뒤 처리
+            if work_available.is_set() and not shutdown_flag:
+                time.sleep(EVENT_DEBOUNCE_SECONDS)
                 
         except KeyboardInterrupt:
             logger.info("⌨️ 키보드 인터럽트 - 종료")
             break
         except Exception as e:
             logger.error(f"❌ 워커 루프 오류: {e}")
-            time.sleep(min(POLL_INTERVAL_SECONDS, 60))
+            error_backoff = wait_with_backoff(error_backoff)
     
     # 종료 정리
+    master_load_pool.shutdown(wait=True)
+    flush_master_export()
+    
+    if pending_watch is not None:
+        try:
+            pending_watch.unsubscribe()
+        except Exception:
+            pass
+    
     with operations_lock:
         if current_operations:
             logger.info(f"🔄 {len(current_operations)}개 작업 완료 대기...")